@@ -4,16 +4,25 @@
 
 import logging
 import base64
+import re
+import sqlite3
+import subprocess
+from shutil import which
+from threading import Lock, local
+from concurrent.futures import ThreadPoolExecutor
 from time import time
 from configparser import ConfigParser
 from io import BytesIO
-from os import walk, path
+from os import scandir, path, makedirs, cpu_count, replace, remove, fsync, O_RDONLY, open as open_fd, close as close_fd
 from argparse import ArgumentParser
 from dataclasses import dataclass
+from uuid import uuid4
+import httpx
+import imagehash
+import orjson
+import pybktree
 from iptcinfo3 import IPTCInfo
 from PIL import Image
-from llama_index.core.schema import ImageDocument
-from llama_index.multi_modal_llms.ollama import OllamaMultiModal
 
 __author__ = "Ernst-Georg Schmid"
 __copyright__ = "Copyright 2025, Ernst-Georg Schmid"
@@ -24,12 +33,29 @@ __status__ = "Production"
 
 LOGGER = logging.getLogger(__name__)
 LLAVA_IMAGE_SIZE = (672, 672)
+LLAVA_JPEG_QUALITY = 75
+# Smaller, lower quality input for --fast. llava 1.6 still tiles it, but into fewer tiles than 672x672
+FAST_IMAGE_SIZE = (336, 336)
+FAST_JPEG_QUALITY = 60
+JPEG_EXTENSIONS = frozenset((""".jpg""", """.jpeg"""))
+CACHE_PATH = path.join(path.expanduser("""~"""), """.cache""", """iptc_annotate.db""")
+CACHE_HASH_SIZE = 16
+CACHE_MAX_DISTANCE = 4
+CACHE_COLOR_BITS = 3
+THREAD_LOCAL = local()
 
 KW_PROMPT = """Please give five keywords describing this picture, separated by ;. Nothing else, just five keywords separated by semicolons. Thank you!"""
 CA_PROMPT = """Please give a short concise abstract describing this picture in one sentence. Nothing else, just the abstract in one sentence. Thank you!"""
+COMBINED_PROMPT = """Please give five keywords describing this picture, separated by ;, on the first line starting with 'KEYWORDS:' and a short concise abstract describing this picture in one sentence on the second line starting with 'ABSTRACT:'. Nothing else, just these two lines. Thank you!"""
 
+# Tolerate numbered lines, markdown and both fields on one line
+KW_PATTERN = re.compile(r"""\bKEYWORDS\W*:\s*(.+?)(?=\W*\bABSTRACT\W*:|\s*$)""", re.IGNORECASE | re.MULTILINE)
+CA_PATTERN = re.compile(r"""\bABSTRACT\W*:\s*(.+?)\s*$""", re.IGNORECASE | re.MULTILINE)
+# Quotes, markdown emphasis and brackets llava sometimes wraps around an answer
+ANSWER_WRAPPING = """ \t\r\n"'`*_[]\u201c\u201d\u2018\u2019"""
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class Configuration:
     ollama_model: str
     ollama_base_url: str
@@ -37,6 +63,10 @@ class Configuration:
     directory: str
     overwrite: bool
     language: str
+    use_cache: bool
+    concurrency: int
+    optimize: bool
+    fast: bool
 
 
 def get_configuration() -> Configuration:
@@ -50,14 +80,34 @@ def get_configuration() -> Configuration:
     argparser.add_argument("-l", "--language", action="store", type=str,
                            default="en",
                            help="""Desired output language as ISO 936-1 code""")
+    argparser.add_argument("-c", "--cache", action="store_true", default=False,
+                           help="""Reuse and record llava answers for near-duplicate images""")
+    argparser.add_argument("-j", "--jobs", action="store", type=int,
+                           default=min(8, cpu_count() or 1),
+                           help="""Number of images annotated in parallel""")
+    argparser.add_argument("--optimize", action="store_true", default=False,
+                           help="""Losslessly optimize annotated images with jpegoptim""")
+    argparser.add_argument("-f", "--fast", action="store_true", default=False,
+                           help="""Send smaller images to llava, faster but less detailed annotations""")
 
     arguments = argparser.parse_args()
 
     if len(arguments.language) != 2:
         LOGGER.error(
-            f"""Language code {arguments.language} is not a proper ISO 936-1 code.""")
+            """Language code %s is not a proper ISO 936-1 code.""", arguments.language)
+        return None
+
+    if arguments.jobs < 1:
+        LOGGER.error(
+            """Number of jobs %s must be at least 1.""", arguments.jobs)
         return None
 
+    optimize = arguments.optimize
+    if optimize and not which("""jpegoptim"""):
+        LOGGER.warning(
+            """jpegoptim not found. Proceeding without optimizing annotated images.""")
+        optimize = False
+
     config_file.read("""iptc_annotate.conf""")
     if config_file:
         try:
@@ -81,7 +131,11 @@ def get_configuration() -> Configuration:
         ollama_timeout=ollama_timeout,
         directory=arguments.directory,
         overwrite=arguments.overwrite,
-        language=arguments.language.lower()
+        language=arguments.language.lower(),
+        use_cache=arguments.cache,
+        concurrency=arguments.jobs,
+        optimize=optimize,
+        fast=arguments.fast
     )
 
     return configuration
@@ -96,117 +150,386 @@ def translate(original_text: str = None, target_language: str = """en""") -> str
             f"""Translation to {target_language} not implemented yet.""")
 
 
-def prepare_image_for_llava(image_path: str = None) -> str:
-    """Prepare the image for llava."""
-    if not image_path or not path.exists(image_path):
+class OllamaClient:
+    """Minimal client for the ollama /api/generate endpoint, shared by all annotation threads."""
+
+    def __init__(self, model: str = None, base_url: str = None, timeout: float = None, max_connections: int = 1):
+        self.url = f"""{base_url.rstrip("/")}/api/generate"""
+        self.client = httpx.Client(timeout=timeout, http2=True,
+                                   limits=httpx.Limits(max_connections=max_connections,
+                                                       max_keepalive_connections=max_connections))
+        self.templates = {}
+        for prompt in (KW_PROMPT, CA_PROMPT, COMBINED_PROMPT):
+            # Serialized once, per call only the base64 image, which needs no JSON escaping, is spliced in
+            head = orjson.dumps({"""model""": model, """prompt""": prompt, """stream""": False,
+                                 """options""": {"""temperature""": 0.0}})
+            self.templates[prompt] = (head[:-1] + b',"images":["', b'"]}')
+
+    def complete(self, prompt: str = None, img_for_llava: bytes = None) -> str:
+        """Send the prompt with the base64 encoded image and return the text of the answer."""
+        head, tail = self.templates[prompt]
+        response = self.client.post(self.url, content=b"".join((head, img_for_llava, tail)),
+                                    headers={"""Content-Type""": """application/json"""})
+        response.raise_for_status()
+
+        return orjson.loads(response.content)["""response"""]
+
+    def close(self) -> None:
+        """Close the connections to ollama."""
+        self.client.close()
+
+
+class AnnotationCache:
+    """Thread-safe cache of llava answers, keyed by the perceptual and the colour hash of the image sent to llava."""
+
+    def __init__(self, cache_path: str = CACHE_PATH, ollama_model: str = None):
+        makedirs(path.dirname(cache_path), exist_ok=True)
+        self.ollama_model = ollama_model
+        self.lock = Lock()
+        self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS annotations (model TEXT NOT NULL, image_hash TEXT NOT NULL, color_hash TEXT NOT NULL, keywords TEXT, caption_abstract TEXT, PRIMARY KEY (model, image_hash, color_hash))""")
+        self.connection.commit()
+        self.entries = {}
+        for image_hash, color_hash, keywords, caption_abstract in self.connection.execute(
+                """SELECT image_hash, color_hash, keywords, caption_abstract FROM annotations WHERE model = ?""", (ollama_model,)):
+            self.entries[(image_hash, color_hash)] = (keywords, caption_abstract)
+        self.image_hashes = {image_hash for image_hash, _ in self.entries}
+        # ImageHash subtraction is the Hamming distance
+        self.tree = pybktree.BKTree(lambda a, b: a - b,
+                                    [imagehash.hex_to_hash(image_hash) for image_hash in self.image_hashes])
+
+    def lookup(self, img_hash: tuple = None) -> tuple:
+        """Return keywords and caption/abstract of the closest cached image within CACHE_MAX_DISTANCE and of the same colours."""
+        perceptual_hash, color_hash = img_hash
+        with self.lock:
+            # Sorted by distance, closest first
+            for _, cached_hash in self.tree.find(perceptual_hash, CACHE_MAX_DISTANCE):
+                entry = self.entries.get((str(cached_hash), color_hash))
+                if entry:
+                    keywords, caption_abstract = entry
+                    return parse_keywords(keywords), caption_abstract
+
+        return None, None
+
+    def store(self, img_hash: tuple = None, keywords: list = None, caption_abstract: str = None) -> None:
+        """Record new llava answers, keeping already cached fields that were not asked for."""
+        if not keywords and not caption_abstract:
+            return None
+
+        perceptual_hash, color_hash = img_hash
+        image_hash = str(perceptual_hash)
+        keywords = """;""".join(keywords) if keywords else None
+        with self.lock:
+            self.connection.execute(
+                """INSERT INTO annotations (model, image_hash, color_hash, keywords, caption_abstract) VALUES (?, ?, ?, ?, ?) ON CONFLICT (model, image_hash, color_hash) DO UPDATE SET keywords = COALESCE(excluded.keywords, keywords), caption_abstract = COALESCE(excluded.caption_abstract, caption_abstract)""",
+                (self.ollama_model, image_hash, color_hash, keywords, caption_abstract))
+            self.connection.commit()
+
+            old_keywords, old_caption_abstract = self.entries.get(
+                (image_hash, color_hash), (None, None))
+            if image_hash not in self.image_hashes:
+                self.image_hashes.add(image_hash)
+                self.tree.add(perceptual_hash)
+            self.entries[(image_hash, color_hash)] = (
+                keywords or old_keywords, caption_abstract or old_caption_abstract)
+
         return None
 
-    img = Image.open(image_path)
-    # LLava works best with images sized 672x672, 336x1344, or 1344x336
-    img = img.resize(LLAVA_IMAGE_SIZE, Image.Resampling.LANCZOS)
-    buffered = BytesIO()
-    img.save(buffered, format="JPEG", quality=75)
-    img_str = base64.b64encode(buffered.getvalue())
-    buffered.close()
-    img.close()
+    def close(self) -> None:
+        """Close the cache database."""
+        self.connection.close()
+
+
+def get_buffer() -> BytesIO:
+    """Get the JPEG encoding buffer of the current thread, rewound but not truncated to keep its memory."""
+    buffered = getattr(THREAD_LOCAL, """buffered""", None)
+    if buffered is None:
+        buffered = BytesIO()
+        THREAD_LOCAL.buffered = buffered
+    buffered.seek(0)
+
+    return buffered
+
+
+def hash_image(img: Image.Image = None) -> tuple:
+    """Return the perceptual hash and the hex colour hash of an image for the cache."""
+    return (imagehash.phash(img, hash_size=CACHE_HASH_SIZE),
+            str(imagehash.colorhash(img, binbits=CACHE_COLOR_BITS)))
+
+
+def prepare_image_for_llava(image_path: str = None, fast: bool = False, want_hash: bool = False) -> tuple:
+    """Prepare the image for llava. Returns the base64 encoded JPEG and, if wanted, its hashes for the cache."""
+    image_size = FAST_IMAGE_SIZE if fast else LLAVA_IMAGE_SIZE
+    jpeg_quality = FAST_JPEG_QUALITY if fast else LLAVA_JPEG_QUALITY
+
+    # Read the file in one go and decode from memory. This costs RAM of the size of the file,
+    # but saves the separate open and read calls of PIL, which are slow on NFS/SMB shares
+    with open(image_path, "rb") as f:
+        raw = f.read()
+
+    with Image.open(BytesIO(raw)) as img:
+        # Already small enough, so send the original JPEG without resampling and encoding it again.
+        # Image.open() only reads the header, the pixels are decoded only if a hash is wanted
+        if img.format == """JPEG""" and img.mode in ("""RGB""", """L""") and img.size[0] <= image_size[0] and img.size[1] <= image_size[1]:
+            img_hash = hash_image(img) if want_hash else None
+            return base64.b64encode(raw), img_hash
+
+        # Let libjpeg downscale by 1/2, 1/4 or 1/8 while decoding, never below the target size
+        img.draft(img.mode, image_size)
+        # Resample and encode in RGB only. CMYK or grayscale with alpha would take slower paths or fail as JPEG
+        if img.mode != """RGB""":
+            img = img.convert("""RGB""")
+        # LLava works best with images sized 672x672, 336x1344, or 1344x336
+        with img.resize(image_size, Image.Resampling.LANCZOS) as resized_img:
+            img_hash = hash_image(resized_img) if want_hash else None
+            buffered = get_buffer()
+            resized_img.save(buffered, format="JPEG", quality=jpeg_quality,
+                             optimize=True, progressive=True)
+            # Encode straight from the buffer without copying it into bytes first, up to the end of this
+            # JPEG. The views must be released before the buffer is written again, hence the with block
+            with buffered.getbuffer() as view, view[:buffered.tell()] as jpeg:
+                img_str = base64.b64encode(jpeg)
+
+    return img_str, img_hash
+
+
+def clean_answer(text: str = None) -> str:
+    """Strip surrounding whitespace, quotes and markdown from a llava answer."""
+    if not text:
+        return None
+    return text.strip(ANSWER_WRAPPING) or None
 
-    return img_str
 
+def parse_keywords(text: str = None) -> list:
+    """Split a ;-separated llava answer into a list of keywords, stripped like clean_answer()."""
+    if not text:
+        return None
+    return [k.strip(ANSWER_WRAPPING) for k in text.split(';') if len(k.strip(ANSWER_WRAPPING)) > 0]
 
-def annotate_image(image_path: str = None, configuration: Configuration = None) -> None:
-    """Annotate a single image with keywords and captions."""
 
-    img_for_llava = prepare_image_for_llava(image_path=image_path)
+def query_llava(ollama_client: OllamaClient = None, img_for_llava: bytes = None,
+                want_keywords: bool = True, want_caption_abstract: bool = True) -> tuple:
+    """Ask llava for keywords and/or a caption/abstract, with a single request per image if possible."""
+    new_keywords, new_caption_abstract = None, None
+
+    if want_keywords and want_caption_abstract:
+        text = ollama_client.complete(
+            prompt=COMBINED_PROMPT, img_for_llava=img_for_llava)
+        kw_match = KW_PATTERN.search(text)
+        ca_match = CA_PATTERN.search(text)
+        new_keywords = parse_keywords(kw_match.group(1) if kw_match else None)
+        new_caption_abstract = clean_answer(ca_match.group(1)) if ca_match else None
+
+    # Ask separately for whatever is wanted and was not in a usable combined answer. An unusable
+    # combined answer thus costs three requests. A failing request must not lose the other field
+    if want_keywords and not new_keywords:
+        try:
+            new_keywords = parse_keywords(ollama_client.complete(
+                prompt=KW_PROMPT, img_for_llava=img_for_llava))
+        except Exception as e:
+            LOGGER.error("""Error asking llava for keywords: %s.""", e)
+
+    if want_caption_abstract and not new_caption_abstract:
+        try:
+            new_caption_abstract = clean_answer(ollama_client.complete(
+                prompt=CA_PROMPT, img_for_llava=img_for_llava))
+        except Exception as e:
+            LOGGER.error("""Error asking llava for caption/abstract: %s.""", e)
+
+    return new_keywords, new_caption_abstract
+
+
+def optimize_jpeg(image_path: str = None) -> None:
+    """Losslessly optimize the Huffman tables of a JPEG and make it progressive, keeping all metadata."""
+    result = subprocess.run(["""jpegoptim""", """--strip-none""", """--all-progressive""", """-q""", image_path],
+                            check=False)
+    if result.returncode != 0:
+        LOGGER.warning("""jpegoptim failed on %s with exit code %s.""",
+                       image_path, result.returncode)
+
+    return None
+
 
-    if not img_for_llava:
-        LOGGER.error(f"""Input image {image_path} not found.""")
+def existing_annotations(info: IPTCInfo = None, overwrite: bool = False) -> tuple:
+    """Return the IPTC keywords and caption/abstract to keep, none if the image is to be annotated anew."""
+    if overwrite:
+        return None, None
+    return info["""keywords"""], info["""caption/abstract"""]
+
+
+def annotate_image(image_path: str = None, configuration: Configuration = None, ollama_client: OllamaClient = None, cache: AnnotationCache = None) -> None:
+    """Annotate a single image with keywords and captions."""
+    LOGGER.info("Annotating: %s", image_path)
+
+    if not image_path or not path.exists(image_path):
+        LOGGER.error("""Input image %s not found.""", image_path)
         return None
 
     must_save = False
 
-    llava_multi_modal_llm = OllamaMultiModal(
-        model=configuration.ollama_model,
-        temperature=0.0,
-        request_timeout=configuration.ollama_timeout,
-        base_url=configuration.ollama_base_url,
-    )
-
     info = IPTCInfo(image_path, force=True,
                     inp_charset="""utf-8""", out_charset="""utf-8""")
     if not info:
-        LOGGER.error(f"""Input image {image_path} not readable.""")
+        LOGGER.error("""Input image %s not readable.""", image_path)
         return None
 
-    if configuration.overwrite:
-        old_keywords = None
-        old_caption_abstract = None
-    else:
-        old_keywords = info["""keywords"""]
-        old_caption_abstract = info["""caption/abstract"""]
+    old_keywords, old_caption_abstract = existing_annotations(
+        info=info, overwrite=configuration.overwrite)
+
+    # Nothing to do, so do not even decode the image
+    if old_keywords and old_caption_abstract:
+        LOGGER.info("""Already annotated, skipping: %s""", image_path)
+        return None
 
     if old_keywords:
         LOGGER.info(
-            f"""Keywords found in {image_path}. Will not overwrite unless --overwrite is set.""")
-    else:
+            """Keywords found in %s. Will not overwrite unless --overwrite is set.""", image_path)
+
+    if old_caption_abstract:
+        LOGGER.info(
+            """Caption/Abstract found in %s. Will not overwrite unless --overwrite is set.""", image_path)
+
+    # The hash is only needed to look up and record cached answers
+    try:
+        img_for_llava, img_hash = prepare_image_for_llava(
+            image_path=image_path, fast=configuration.fast, want_hash=cache is not None)
+    except OSError as e:
+        LOGGER.error("""Cannot read or decode image %s: %s.""", image_path, e)
+        return None
+
+    new_keywords, new_caption_abstract = None, None
+    # With --overwrite, fresh answers are wanted, so they are only recorded
+    if cache and not configuration.overwrite:
+        new_keywords, new_caption_abstract = cache.lookup(img_hash=img_hash)
+        if new_keywords or new_caption_abstract:
+            LOGGER.info("""Reusing cached answers for similar image %s.""", image_path)
+
+    want_keywords = not old_keywords and not new_keywords
+    want_caption_abstract = not old_caption_abstract and not new_caption_abstract
+
+    query_failed = False
+    if want_keywords or want_caption_abstract:
         try:
-            llava_response = llava_multi_modal_llm.complete(
-                prompt=KW_PROMPT,
-                image_documents=[ImageDocument(image=img_for_llava)],
-            )
-
-            new_keywords = llava_response.text.split(';')
-            new_keywords = [translate(original_text=k.strip(), target_language=configuration.language).lower()
-                            for k in new_keywords if len(k.strip()) > 0]
-            LOGGER.info(f"""New keywords: {new_keywords}.""")
+            llava_keywords, llava_caption_abstract = query_llava(
+                ollama_client=ollama_client, img_for_llava=img_for_llava,
+                want_keywords=want_keywords, want_caption_abstract=want_caption_abstract)
+            new_keywords = new_keywords or llava_keywords
+            new_caption_abstract = new_caption_abstract or llava_caption_abstract
+            if cache:
+                cache.store(img_hash=img_hash, keywords=llava_keywords,
+                            caption_abstract=llava_caption_abstract)
+        except Exception as e:
+            LOGGER.error("""Error annotating image %s: %s.""", image_path, e)
+            query_failed = True
+
+    # If llava did not answer at all, the error is logged already and there is no response to complain about
+    if not old_keywords and (new_keywords or not query_failed):
+        try:
+            if not new_keywords:
+                raise ValueError("""No keywords in llava response""")
+            new_keywords = [translate(original_text=k, target_language=configuration.language).lower()
+                            for k in new_keywords]
+            LOGGER.info("""New keywords: %s.""", new_keywords)
             info["""keywords"""] = new_keywords
             must_save = True
         except Exception as e:
             LOGGER.error(
-                f"""Error annotating image {image_path} with keywords: {e}.""")
+                """Error annotating image %s with keywords: %s.""", image_path, e)
 
-    if old_caption_abstract:
-        LOGGER.info(
-            f"""Caption/Abstract found in {image_path}. Will not overwrite unless --overwrite is set.""")
-    else:
+    if not old_caption_abstract and (new_caption_abstract or not query_failed):
         try:
-            llava_response = llava_multi_modal_llm.complete(
-                prompt=CA_PROMPT,
-                image_documents=[ImageDocument(image=img_for_llava)],
-            )
-            new_caption_abstract = llava_response.text.strip()
+            if not new_caption_abstract:
+                raise ValueError("""No caption/abstract in llava response""")
             new_caption_abstract = translate(
                 original_text=new_caption_abstract, target_language=configuration.language)
-            LOGGER.info(f"""New caption/abstract: {new_caption_abstract}.""")
+            LOGGER.info("""New caption/abstract: %s.""", new_caption_abstract)
             info["""caption/abstract"""] = new_caption_abstract
             must_save = True
         except Exception as e:
             LOGGER.error(
-                f"""Error annotating image {image_path} with caption/abstract: {e}.""")
+                """Error annotating image %s with caption/abstract: %s.""", image_path, e)
 
     if must_save:
-        info.save(options=["overwrite"])
+        # Write next to the original, flush it to disk and swap it in atomically, so neither an interrupted
+        # run nor a power loss leaves a half written image behind. Unlike IPTCInfo.save(), this keeps no image~ backup.
+        # The random suffix makes sure no file of the user is overwritten or removed
+        tmp_path = f"""{image_path}.{uuid4().hex}.tmp"""
+        try:
+            info.save_as(tmp_path, options=["overwrite"])
+            # IPTCInfo copies the mode of the original, so a read-only image gives a read-only temporary file
+            fd = open_fd(tmp_path, O_RDONLY)
+            try:
+                fsync(fd)
+            finally:
+                close_fd(fd)
+            replace(tmp_path, image_path)
+        except Exception as e:
+            LOGGER.error("""Error saving image %s: %s.""", image_path, e)
+            try:
+                if path.exists(tmp_path):
+                    remove(tmp_path)
+            except OSError as e:
+                LOGGER.warning("""Cannot remove temporary file %s: %s.""", tmp_path, e)
+            return None
+        if configuration.optimize:
+            optimize_jpeg(image_path=image_path)
     else:
-        LOGGER.warning(f"""No changes made to {image_path}.""")
+        LOGGER.warning("""No changes made to %s.""", image_path)
 
     return None
 
 
+def iter_jpegs(directory: str = None):
+    """Recursively yield the paths of all JPEG images below directory."""
+    try:
+        with scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from iter_jpegs(entry.path)
+                elif entry.is_file() and path.splitext(entry.name)[1].lower() in JPEG_EXTENSIONS:
+                    yield entry.path
+                else:
+                    LOGGER.info("Skipping non-JPEG: %s", entry.path)
+    except OSError as e:
+        LOGGER.warning("""Cannot scan directory %s: %s.""", directory, e)
+
+
 def annotate_images(configuration: Configuration) -> None:
     """Recursively scan a directory for images and annotate them with captions, keywords and abstracts."""
     if not configuration.directory:
         LOGGER.error("""No working directory provided.""")
         return None
 
-    for root, _, filenames in walk(configuration.directory, topdown=True):
-        for filename in filenames:
-            image_path = path.join(root, filename)
-            if image_path.lower().endswith((""".jpg""", """.jpeg""")):
-                LOGGER.info(f"Annotating: {image_path}")
-                annotate_image(
-                    image_path=image_path, configuration=configuration)
-            else:
-                LOGGER.info(f"Skipping non-JPEG: {image_path}")
-                continue
+    # One client for the whole run, instead of one per image. It connects on the first request only,
+    # so a run over an already annotated library never talks to ollama
+    ollama_client = OllamaClient(
+        model=configuration.ollama_model,
+        base_url=configuration.ollama_base_url,
+        timeout=configuration.ollama_timeout,
+        max_connections=configuration.concurrency,
+    )
+
+    cache = None
+    if configuration.use_cache:
+        try:
+            # Answers for --fast inputs are cached apart, so they do not stand in for full size ones
+            cache_model = f"""{configuration.ollama_model}@fast""" if configuration.fast else configuration.ollama_model
+            cache = AnnotationCache(ollama_model=cache_model)
+        except (OSError, sqlite3.Error) as e:
+            LOGGER.warning(
+                """Cannot open cache %s: %s. Proceeding without cache.""", CACHE_PATH, e)
+
+    # Annotation is bound by the llava round trip, so threads keep several requests in flight.
+    # Already annotated images are skipped inside the workers, after reading only their IPTC data
+    try:
+        with ThreadPoolExecutor(max_workers=configuration.concurrency) as executor:
+            list(executor.map(lambda image_path: annotate_image(
+                image_path=image_path, configuration=configuration, ollama_client=ollama_client, cache=cache), iter_jpegs(configuration.directory)))
+    finally:
+        if cache:
+            cache.close()
+        ollama_client.close()
 
     return None
 
@@ -220,6 +543,6 @@ if __name__ == """__main__""":
     if configuration:
         annotate_images(configuration=configuration)
         LOGGER.info(
-            f"""Completed annotating images in {time() - start:.2f} seconds.""")
+            """Completed annotating images in %.2f seconds.""", time() - start)
     else:
         LOGGER.error("""No configuration found.""")